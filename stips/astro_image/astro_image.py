@@ -24,7 +24,7 @@ from ..utilities import SelectParameter
 from ..utilities import sersic_lum
 from ..utilities import rind
 # PSF making functions
-from ..utilities.makePSF import interpolate_epsf, make_epsf, place_source
+from ..utilities.makePSF import interpolate_epsf, make_epsf, place_source, place_sources
 # PSF constants
 from ..utilities.makePSF import PSF_BOXSIZE, PSF_BRIGHT_BOXSIZE, PSF_EXTRA_BRIGHT_BOXSIZE, PSF_GRID_SIZE, PSF_UPSCALE
 
@@ -544,8 +544,8 @@ class AstroImage(object):
 
         Returns
         -------
-        psf_array : list
-            3 x 3 list with the corresponding input ePSFs.
+        psf_array : numpy.ndarray
+            3 x 3 array with the corresponding input ePSFs.
         """
 
         have_psf = False
@@ -618,7 +618,11 @@ class AstroImage(object):
             msg = "{}: Finished PSF Grid creation at {}"
             self._log("info", msg.format(self.name, time.ctime()))
 
-        psf_data = self.psf.data
+        # The ePSFs only need single precision, like the output image, and
+        # this halves the memory traffic of interpolating them per source.
+        # Data read from FITS may be big-endian or not C-ordered, so also
+        # make the buffer native and C-contiguous for the compiled loops.
+        psf_data = np.ascontiguousarray(self.psf.data, dtype=np.float32)
 
         # Create ePSF
         epsf_0_0 = make_epsf(psf_data[0])
@@ -632,9 +636,9 @@ class AstroImage(object):
         epsf_2_2 = make_epsf(psf_data[8])
 
         # Reshape Array of ePSFs
-        psf_array = [[epsf_0_0, epsf_0_1, epsf_0_2],
-                     [epsf_1_0, epsf_1_1, epsf_1_2],
-                     [epsf_2_0, epsf_2_1, epsf_2_2]]
+        psf_array = np.array([[epsf_0_0, epsf_0_1, epsf_0_2],
+                              [epsf_1_0, epsf_1_1, epsf_1_2],
+                              [epsf_2_0, epsf_2_1, epsf_2_2]])
 
         psf_middle = rind((psf_data[0].shape[0]-1) / 2)
 
@@ -663,29 +667,43 @@ class AstroImage(object):
             xbright_psf_array, xbright_psf_middle = self.make_epsf_array('xbright')
             xbright_boxsize = np.floor(xbright_psf_middle)/PSF_UPSCALE
 
-        for k, (xpix, ypix, flux, mag) in enumerate(zip(xs, ys, fluxes, mags)):
-            self.addHistory("Adding point source {} at {},{}".format(k+1, xpix, ypix))
-            self._log("info", "Adding point source {} to AstroImage {},{}".format(k+1, xpix, ypix))
-
-            if not self.has_psf:  # just add point source
+        if not self.has_psf:  # just add point sources
+            for k, (xpix, ypix, flux) in enumerate(zip(xs, ys, fluxes)):
+                self.addHistory("Adding point source {} at {},{}".format(k+1, xpix, ypix))
+                self._log("info", "Adding point source {} to AstroImage {},{}".format(k+1, xpix, ypix))
                 self._log("warning", "No PSF found, adding as point source")
                 self.data[ypix, xpix] += flux
-                continue  # break the loop
+            return
 
-            # Create interpolated ePSF from input PSF files
-            if mag > self.bright_limit:
-                epsf = interpolate_epsf(xpix, ypix, psf_array, image_size)
-                self.data = place_source(xpix, ypix, flux, self.data, epsf, boxsize=boxsize, psf_center=psf_middle)
-            elif (self.xbright_limit < mag < self.bright_limit):
+        xs, ys, fluxes, mags = (np.asarray(a) for a in (xs, ys, fluxes, mags))
+        for k, (xpix, ypix, mag) in enumerate(zip(xs, ys, mags)):
+            self.addHistory("Adding point source {} at {},{}".format(k+1, xpix, ypix))
+            self._log("info", "Adding point source {} to AstroImage {},{}".format(k+1, xpix, ypix))
+            if (self.xbright_limit < mag < self.bright_limit):
                 self.addHistory("Placing Bright Source with mag = {}".format(mag))
                 self._log("info", "Placing Bright Source with mag = {}".format(mag))
-                epsf = interpolate_epsf(xpix, ypix, bright_psf_array, image_size)
-                self.data = place_source(xpix, ypix, flux, self.data, epsf, boxsize=bright_boxsize, psf_center=bright_psf_middle)
             elif mag < self.xbright_limit:
                 self.addHistory("Placing Extra Bright Source with mag = {}".format(mag))
                 self._log("info", "Placing Extra Bright Source with mag = {}".format(mag))
-                epsf = interpolate_epsf(xpix, ypix, xbright_psf_array, image_size)
-                self.data = place_source(xpix, ypix, flux, self.data, epsf, boxsize=xbright_boxsize, psf_center=xbright_psf_middle)
+
+        # Place all the sources of each brightness with the interpolated
+        # ePSF at their location, in one call each.
+        n_threads = SelectParameter('cores', kwargs)
+        flux_threshold = SelectParameter('psf_flux_threshold', kwargs) or 0.
+        normal = mags > self.bright_limit
+        self.data = place_sources(xs[normal], ys[normal], fluxes[normal], self.data, psf_array,
+                                  boxsize=boxsize, psf_center=psf_middle,
+                                  n_threads=n_threads, flux_threshold=flux_threshold)
+        if are_bright:
+            bright = (self.xbright_limit < mags) & (mags < self.bright_limit)
+            self.data = place_sources(xs[bright], ys[bright], fluxes[bright], self.data, bright_psf_array,
+                                      boxsize=bright_boxsize, psf_center=bright_psf_middle,
+                                      n_threads=n_threads, flux_threshold=flux_threshold)
+        if are_xbright:
+            xbright = mags < self.xbright_limit
+            self.data = place_sources(xs[xbright], ys[xbright], fluxes[xbright], self.data, xbright_psf_array,
+                                      boxsize=xbright_boxsize, psf_center=xbright_psf_middle,
+                                      n_threads=n_threads, flux_threshold=flux_threshold)
 
     def cropToBaseSize(self):
         """
@@ -12,7 +12,7 @@ Current assumptions:
 Pending:
 - Write logging functions in.
 - Implement error catching.
-- make_epsf() and real_psf() have not been optimized.
+- real_psf() has not been optimized.
 - Write tests for all functions.
 
 :Author: Sebastian Gomez
@@ -20,9 +20,20 @@ Pending:
 """
 
 # External modules
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import math
 import numpy as np
+import os
 from scipy import ndimage
 
+# Optional modules
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
 # Convolution Constants
 # Inter Pixel Capacitance
 IPC = np.array([[0.21,  1.62,  0.20],
@@ -36,6 +47,9 @@ EPSF4 = np.array([[0.25, 0.5, 0.5, 0.5, 0.25],
                   [0.50, 1.0, 1.0, 1.0, 0.50],
                   [0.50, 1.0, 1.0, 1.0, 0.50],
                   [0.25, 0.5, 0.5, 0.5, 0.25]])
+# EPSF4 is separable, EPSF4 = np.outer(EPSF4_1D, EPSF4_1D), so it can
+# be applied as two 1D convolutions along each axis.
+EPSF4_1D = np.array([0.5, 1.0, 1.0, 1.0, 0.5])
 
 # The ePSF is *always* 4x upscaled
 PSF_UPSCALE = 4
@@ -67,64 +81,125 @@ def make_epsf(psf_in):
     Returns
     -------
     psf_final : numpy.ndarray
-        2D array with ePSF of same shape as psf_in
+        2D array with ePSF of same shape and dtype as psf_in
 
     """
 
-    # Empty array to fill later
-    psf_out = np.zeros_like(psf_in)
-
     # Assuming the PSF is square
     size = psf_in.shape[0]
 
-    # Create ePSF
-    psf_out = ndimage.convolve(psf_in, EPSF4, mode='constant', cval=0.0)
-
-    # Apply correct scaling to edges of the image, currently done in
-    # individual steps for computational reasons.
-    # Multiply columns x16
-    psf_out[0:size,      0] = psf_in[0:size,      0]*16.0
-    psf_out[0:size,      1] = psf_in[0:size,      1]*16.0
-    psf_out[0:size,      2] = psf_in[0:size,      2]*16.0
-    psf_out[0:size, size-1] = psf_in[0:size, size-1]*16.0
-    psf_out[0:size, size-2] = psf_in[0:size, size-2]*16.0
-    psf_out[0:size, size-3] = psf_in[0:size, size-3]*16.0
-    # Multiply rows x16, while excluding the corners that were
-    # already multiplied in the previous step
-    psf_out[0, 3:(size-PSF_UPSCALE)+1] = psf_in[0, 3:(size-PSF_UPSCALE)+1]*16.0
-    psf_out[1, 3:(size-PSF_UPSCALE)+1] = psf_in[1, 3:(size-PSF_UPSCALE)+1]*16.0
-    psf_out[2, 3:(size-PSF_UPSCALE)+1] = psf_in[2, 3:(size-PSF_UPSCALE)+1]*16.0
-    psf_out[size-1, 3:(size-PSF_UPSCALE)+1] = psf_in[size-1, 3:(size-PSF_UPSCALE)+1]*16.0
-    psf_out[size-2, 3:(size-PSF_UPSCALE)+1] = psf_in[size-2, 3:(size-PSF_UPSCALE)+1]*16.0
-    psf_out[size-3, 3:(size-PSF_UPSCALE)+1] = psf_in[size-3, 3:(size-PSF_UPSCALE)+1]*16.0
-
-    # Empty Array
-    psf_final = np.zeros_like(psf_in)
-
-    # Do calculation for every pixel in PSF image
-    x_range = range(PSF_UPSCALE, size-PSF_UPSCALE-1)
-    y_range = range(PSF_UPSCALE, size-PSF_UPSCALE-1)
-
-    # Add IPC to output PSF
-    for idx in x_range:
-        for idy in y_range:
-            pcen = psf_out[idy, idx]
-
-            psf_final[idy-PSF_UPSCALE, idx-PSF_UPSCALE] += pcen*IPC[0, 0]
-            psf_final[idy-PSF_UPSCALE,             idx] += pcen*IPC[0, 1]
-            psf_final[idy-PSF_UPSCALE, idx+PSF_UPSCALE] += pcen*IPC[0, 2]
-
-            psf_final[idy, idx-PSF_UPSCALE] += pcen*IPC[1, 0]
-            psf_final[idy,             idx] += pcen*IPC[1, 1]
-            psf_final[idy, idx+PSF_UPSCALE] += pcen*IPC[1, 2]
-
-            psf_final[idy+PSF_UPSCALE, idx-PSF_UPSCALE] += pcen*IPC[2, 0]
-            psf_final[idy+PSF_UPSCALE,             idx] += pcen*IPC[2, 1]
-            psf_final[idy+PSF_UPSCALE, idx+PSF_UPSCALE] += pcen*IPC[2, 2]
+    # Create ePSF, convolving with EPSF4 one axis at a time. For a
+    # separable kernel this stays faster than an FFT convolution even
+    # for much larger kernels and PSFs.
+    psf_out = ndimage.convolve1d(psf_in, EPSF4_1D, axis=0, mode='constant', cval=0.0)
+    psf_out = ndimage.convolve1d(psf_out, EPSF4_1D, axis=1, mode='constant', cval=0.0)
+
+    # Apply correct scaling to the 3 outermost rows and columns of the
+    # image, which the convolution only partially covers.
+    np.multiply(psf_in, 16.0, out=psf_out, where=_edge_mask(size))
+
+    # Add IPC to output PSF, with the IPC kernel in the precision of the
+    # ePSF so that single precision ePSFs are not promoted to double
+    psf_final = _ipc_apply(psf_out, IPC.astype(psf_out.dtype, copy=False), size)
 
     return psf_final
 
 
+@lru_cache
+def _edge_mask(size):
+    """
+    Boolean mask of the 3 outermost rows and columns of a (square)
+    PSF image of a given size.
+
+    Parameters
+    ----------
+    size : int
+        Size of the PSF image
+
+    Returns
+    -------
+    edge : numpy.ndarray
+        2D boolean array, True on the edges of the image
+    """
+
+    edge = np.zeros((size, size), dtype=bool)
+    edge[:, :3] = True
+    edge[:, -3:] = True
+    edge[:3, :] = True
+    edge[-3:, :] = True
+    # The mask is shared between calls, so make sure it is never modified
+    edge.flags.writeable = False
+
+    return edge
+
+
+def _ipc_apply_numpy(psf_out, ipc, size):
+    """
+    Apply the IPC kernel to an ePSF. Every pixel sufficiently far from the
+    edges leaks a fraction of its charge into the pixels one real pixel
+    (PSF_UPSCALE ePSF pixels) away, so the kernel is applied as 9 shifted
+    slice additions.
+
+    Parameters
+    ----------
+    psf_out : numpy.ndarray
+        2D array with ePSF image
+    ipc : numpy.ndarray
+        3 x 3 IPC kernel
+    size : int
+        Size of the (square) ePSF image
+
+    Returns
+    -------
+    psf_final : numpy.ndarray
+        2D array with IPC applied to the ePSF
+    """
+
+    psf_final = np.zeros_like(psf_out)
+
+    lo = PSF_UPSCALE
+    hi = size-PSF_UPSCALE-1
+    core = psf_out[lo:hi, lo:hi]
+
+    for iy, dy in enumerate((-PSF_UPSCALE, 0, PSF_UPSCALE)):
+        for ix, dx in enumerate((-PSF_UPSCALE, 0, PSF_UPSCALE)):
+            psf_final[lo+dy:hi+dy, lo+dx:hi+dx] += core*ipc[iy, ix]
+
+    return psf_final
+
+
+if HAS_NUMBA:
+    @njit(cache=True, fastmath=True, parallel=True)
+    def _ipc_apply_numba(psf_out, ipc, size):
+        """
+        Compiled version of _ipc_apply_numpy. Each output row only receives
+        charge from 3 rows of the input, so the rows are filled in parallel
+        without any two threads writing to the same pixel.
+        """
+
+        psf_final = np.zeros_like(psf_out)
+
+        lo = PSF_UPSCALE
+        hi = size-PSF_UPSCALE-1
+
+        for y in prange(size):
+            for iy in range(3):
+                sy = y-(iy-1)*PSF_UPSCALE
+                if sy < lo or sy >= hi:
+                    continue
+                for ix in range(3):
+                    dx = (ix-1)*PSF_UPSCALE
+                    c = ipc[iy, ix]
+                    for sx in range(lo, hi):
+                        psf_final[y, sx+dx] += c*psf_out[sy, sx]
+
+        return psf_final
+
+    _ipc_apply = _ipc_apply_numba
+else:
+    _ipc_apply = _ipc_apply_numpy
+
+
 def bicubic(epsf, iy, ix, fx, fy):
     """
     Perform the bi-cubic interpolation of an image from a center
@@ -154,66 +229,39 @@ def bicubic(epsf, iy, ix, fx, fy):
         Output value of fractional light
     """
 
-    # Lower Left Value
-    A1 = (epsf[iy,     ix])
-    B1 = (epsf[iy,   ix+1]-epsf[iy,   ix-1])/2
-    C1 = (epsf[iy+1,   ix]-epsf[iy-1,   ix])/2
-    D1 = (epsf[iy,   ix+1]+epsf[iy,   ix-1]-2*A1)/2
-    E1 = (epsf[iy+1, ix+1]-A1)
-    F1 = (epsf[iy+1,   ix]+epsf[iy-1,   ix]-2*A1)/2
-    V1 = (A1
-          + B1*(fx)
-          + C1*(fy)
-          + D1*(fx)**2
-          + E1*(fx)*(fy)
-          + F1*(fy)**2)
-
-    # Lower Right Value
-    A2 = (epsf[iy,   ix+1])
-    B2 = (epsf[iy,   ix+2]-epsf[iy,     ix])/2
-    C2 = (epsf[iy+1, ix+1]-epsf[iy-1, ix+1])/2
-    D2 = (epsf[iy,   ix+2]+epsf[iy,     ix]-2*A2)/2
-    E2 = -(epsf[iy+1,   ix]-A2)
-    F2 = (epsf[iy+1, ix+1]+epsf[iy-1, ix+1]-2*A2)/2
-    V2 = (A2
-          + B2*(fx-1)
-          + C2*(fy)
-          + D2*(fx-1)**2
-          + E2*(fx-1)*(fy)
-          + F2*(fy)**2)
-
-    # Upper Left Value
-    A3 = (epsf[iy+1,   ix])
-    B3 = (epsf[iy+1, ix+1]-epsf[iy+1, ix-1])/2
-    C3 = (epsf[iy+2,   ix]-epsf[iy,     ix])/2
-    D3 = (epsf[iy+1, ix+1]+epsf[iy+1, ix-1]-2*A3)/2
-    E3 = -(epsf[iy,   ix+1]-A3)
-    F3 = (epsf[iy+2,   ix]+epsf[iy,     ix]-2*A3)/2
-    V3 = (A3
-          + B3*(fx)
-          + C3*(fy-1)
-          + D3*(fx)**2
-          + E3*(fx)*(fy-1)
-          + F3*(fy-1)**2)
-
-    # Upper Right Value
-    A4 = (epsf[iy+1, ix+1])
-    B4 = (epsf[iy+1, ix+2]-epsf[iy+1,   ix])/2
-    C4 = (epsf[iy+2, ix+1]-epsf[iy,   ix+1])/2
-    D4 = (epsf[iy+1, ix+2]+epsf[iy+1,   ix]-2*A4)/2
-    E4 = (epsf[iy,     ix]-A4)
-    F4 = (epsf[iy+2, ix+1]+epsf[iy,   ix+1]-2*A4)/2
-    V4 = (A4
-          + B4*(fx-1)
-          + C4*(fy-1)
-          + D4*(fx-1)**2
-          + E4*(fx-1)*(fy-1)
-          + F4*(fy-1)**2)
-
-    rpsf_phot = ((1-fx)*(1-fy)*V1
-                 + (fx)*(1-fy)*V2
-                 + (1-fx)*(fy)*V3
-                 + (fx)*(fy)*V4)
+    # The 12 ePSF samples around the reference pixel used by the fit,
+    # named e<y><x> after their offset from (iy, ix), with m for -1.
+    em0 = epsf[iy-1,   ix]
+    em1 = epsf[iy-1, ix+1]
+    e0m = epsf[iy,   ix-1]
+    e00 = epsf[iy,     ix]
+    e01 = epsf[iy,   ix+1]
+    e02 = epsf[iy,   ix+2]
+    e1m = epsf[iy+1, ix-1]
+    e10 = epsf[iy+1,   ix]
+    e11 = epsf[iy+1, ix+1]
+    e12 = epsf[iy+1, ix+2]
+    e20 = epsf[iy+2,   ix]
+    e21 = epsf[iy+2, ix+1]
+
+    # The original algorithm fits a quadratic surface around each of the
+    # 4 pixels surrounding (fx, fy), and bi-linearly blends the 4 values.
+    # Both steps are linear in the samples, so the result is evaluated
+    # directly as a weighted sum of the 12 samples, with the weights
+    # written as polynomials of the pixel phase.
+    gx = fx-1
+    gy = fy-1
+    px = (3*fx-2)*fx
+    py = (3*fy-2)*fy
+    fxy = fx*fy
+
+    rpsf_phot = ((-gx*gy*(px+py-2)*e00
+                  + fx*gy*(px+py-2*fx-1)*e01
+                  + fy*gx*(px+py-2*fy-1)*e10
+                  - fxy*(px+py-2*fx-2*fy)*e11
+                  + gy*(fx*gx*gx*e0m - fx*fx*gx*e02)
+                  + gx*(fy*gy*gy*em0 - fy*fy*gy*e20)
+                  + fxy*(fx*gx*e12 + fy*gy*e21 - gx*gx*e1m - gy*gy*em1))/2)
 
     return rpsf_phot
 
@@ -274,6 +322,184 @@ def real_psf(dx, dy, epsf, psf_center=177, boxsize=PSF_BOXSIZE):
     return rpsf_phot
 
 
+def real_psf_vec(dx, dy, epsf, psf_center=177, boxsize=PSF_BOXSIZE):
+    """
+    Vectorized version of real_psf. Calculate the fraction of light
+    from a epsf that should fall on each of a set of pixels. This
+    function assumes the input ePSF was oversampled by a factor of 4.
+
+    Parameters
+    ----------
+    dx : numpy.ndarray
+        relative locations of source along x within boxsize
+        (0) is the center of boxsize.
+    dy : numpy.ndarray
+        relative locations of source along y within boxsize
+        (0) is the center of boxsize. Must be broadcastable
+        against dx.
+    epsf : numpy.ndarray
+        2D array with ePSF image
+    psf_center : int
+        center of the input psf model
+    boxsize : int
+        size of PSF box.
+
+    Returns
+    -------
+    rpsf_phot : numpy.ndarray
+        Output values of fractional light, with the broadcast
+        shape of dx and dy
+    """
+
+    dx, dy = np.broadcast_arrays(np.asarray(dx, dtype=float),
+                                 np.asarray(dy, dtype=float))
+
+    # Relative location of pixel within ePSF (for a factor of 4 oversample)
+    rx = psf_center + dx*4
+    ry = psf_center + dy*4
+    dd = np.sqrt(dx**2+dy**2)
+
+    # Bi-linear interpolation for most of the pixels, which is exactly
+    # what a first order map_coordinates computes
+    rpsf_phot = ndimage.map_coordinates(epsf, [ry, rx], order=1,
+                                        mode='constant', cval=0.0)
+
+    # Pixels outside the boxsize are set to 0
+    inside = (np.abs(dx) <= boxsize) & (np.abs(dy) <= boxsize)
+    rpsf_phot[~inside] = 0.
+
+    # Bi-cubic interpolation for the innermost pixels
+    cub = inside & (dd <= 4.0)
+    ix = rx[cub].astype(int)
+    iy = ry[cub].astype(int)
+    fx = rx[cub]-ix  # Pixel Phase
+    fy = ry[cub]-iy  # Pixel Phase
+    rpsf_phot[cub] = bicubic(epsf, iy, ix, fx, fy)
+
+    return rpsf_phot
+
+
+def _psf_box_numpy(xpix, ypix, epsf, psf_center, boxsize, min_x, max_x, min_y, max_y):
+    """
+    Fractional light of a source at (xpix, ypix) falling on every pixel
+    of the box [min_y:max_y, min_x:max_x], using real_psf_vec.
+
+    Parameters
+    ----------
+    xpix : float
+        x location of source
+    ypix : float
+        y location of source
+    epsf : numpy.ndarray
+        2D array with ePSF
+    psf_center : int
+        center of the input psf model
+    boxsize : int
+        size of PSF box.
+    min_x, max_x, min_y, max_y : int
+        Limits of the box in image pixels
+
+    Returns
+    -------
+    ff : numpy.ndarray
+        2D array of fractional light with shape (max_y-min_y, max_x-min_x)
+    """
+
+    # dx/dy are the pixel positions within the box
+    dy = np.arange(min_y, max_y)-ypix
+    dx = np.arange(min_x, max_x)-xpix
+
+    return real_psf_vec(dx[np.newaxis, :], dy[:, np.newaxis], epsf,
+                        psf_center=psf_center, boxsize=boxsize)
+
+
+if HAS_NUMBA:
+    _bicubic_numba = njit(cache=True, fastmath=True)(bicubic)
+
+    @njit(cache=True, fastmath=True)
+    def _real_psf_numba(dx, dy, epsf, psf_center, boxsize):
+        """
+        Compiled version of real_psf.
+        """
+
+        # If the pixel location is outside the boxsize return 0
+        if (abs(dx) > boxsize) or (abs(dy) > boxsize):
+            return 0.
+
+        # Relative location of pixel within ePSF (for a factor of 4 oversample)
+        rx = psf_center + dx*4
+        ry = psf_center + dy*4
+        ix = int(rx)
+        iy = int(ry)
+        fx = rx-ix  # Pixel Phase
+        fy = ry-iy  # Pixel Phase
+
+        # Bi-linear interpolation for most of the pixels, comparing the
+        # squared distance to avoid a square root per pixel
+        if (dx*dx+dy*dy > 16.0):
+            return ((1-fx)*(1-fy)*epsf[iy,    ix]
+                    + (fx)*(1-fy)*epsf[iy,  ix+1]
+                    + (1-fx)*(fy)*epsf[iy+1,  ix]
+                    + (fx)*(fy)*epsf[iy+1, ix+1])
+
+        # Bi-cubic interpolation for the innermost pixels
+        return _bicubic_numba(epsf, iy, ix, fx, fy)
+
+    @njit(cache=True, fastmath=True, parallel=True)
+    def _psf_box_numba(xpix, ypix, epsf, psf_center, boxsize, min_x, max_x, min_y, max_y):
+        """
+        Compiled version of _psf_box_numpy, with the rows of the box
+        computed in parallel.
+        """
+
+        ff = np.zeros((max_y-min_y, max_x-min_x))
+
+        for j in prange(min_y, max_y):
+            dy = j-ypix
+            for i in range(min_x, max_x):
+                ff[j-min_y, i-min_x] = _real_psf_numba(i-xpix, dy, epsf, psf_center, boxsize)
+
+        return ff
+
+    @njit(cache=True, fastmath=True, nogil=True)
+    def _place_sources_numba(xpix, ypix, flux, image, grid, corners, weights,
+                             min_x, max_x, min_y, max_y, psf_center, boxsize, row0):
+        """
+        Compiled loop of place_sources. The interpolated ePSF of each
+        source is built in a single scratch buffer, reused for all
+        sources, rather than in new temporary arrays. Row j of the image
+        is image[j-row0], so that a band of rows can be filled on its
+        own. The GIL is released, so bands can be filled from threads.
+        """
+
+        epsf = np.empty(grid.shape[1:], dtype=grid.dtype)
+        for n in range(len(xpix)):
+            e0 = grid[corners[n, 0]]
+            e1 = grid[corners[n, 1]]
+            e2 = grid[corners[n, 2]]
+            e3 = grid[corners[n, 3]]
+            w0, w1, w2, w3 = weights[n, 0], weights[n, 1], weights[n, 2], weights[n, 3]
+            # Only interpolate the part of the ePSF that real_psf reads
+            # for this box, with a margin for the bicubic neighbours.
+            y0 = max(0, int(psf_center+(min_y[n]-ypix[n])*PSF_UPSCALE)-2)
+            y1 = min(epsf.shape[0], int(psf_center+(max_y[n]-1-ypix[n])*PSF_UPSCALE)+4)
+            x0 = max(0, int(psf_center+(min_x[n]-xpix[n])*PSF_UPSCALE)-2)
+            x1 = min(epsf.shape[1], int(psf_center+(max_x[n]-1-xpix[n])*PSF_UPSCALE)+4)
+            for y in range(y0, y1):
+                for x in range(x0, x1):
+                    epsf[y, x] = w0*e0[y, x] + w1*e1[y, x] + w2*e2[y, x] + w3*e3[y, x]
+            for j in range(min_y[n], max_y[n]):
+                dy = j-ypix[n]
+                for i in range(min_x[n], max_x[n]):
+                    image[j-row0, i] += flux[n]*_real_psf_numba(i-xpix[n], dy, epsf, psf_center, boxsize)
+
+        return image
+
+    _psf_box = _psf_box_numba
+else:
+    _psf_box = _psf_box_numpy
+
+
 def place_source(xpix, ypix, flux, image, epsf, boxsize=PSF_BOXSIZE, psf_center=177):
     """
     Place a source into image.
@@ -300,85 +526,268 @@ def place_source(xpix, ypix, flux, image, epsf, boxsize=PSF_BOXSIZE, psf_center=
     # Get image size, assuming square
     image_size = image.shape[0]
 
-    # Place if source is within image and boxise
-    if (xpix > 0) & (xpix < image_size) & (ypix > 0) & (ypix < image_size):
-        # Generate a box around the location of the source with size boxsize
-        max_y = min(round(ypix+boxsize), image_size)
-        min_y = max(0, round(ypix-boxsize))
-        max_x = min(round(xpix+boxsize), image_size)
-        min_x = max(0, round(xpix-boxsize))
-        # Apply real_psf for every pixel in the box, dx/dy are the pixel
-        # positions within the box.
-        for j in range(min_y, max_y):
-            dy = j-ypix
-            for i in range(min_x, max_x):
-                dx = i-xpix
-                ff = real_psf(dx, dy, epsf, psf_center=psf_center, boxsize=boxsize)
-                ffa = (flux*ff)
-                image[j, i] += ffa
+    # Only place if source is within image
+    if not ((xpix > 0) & (xpix < image_size) & (ypix > 0) & (ypix < image_size)):
+        return image
+
+    # Generate a box around the location of the source with size boxsize,
+    # clipped to the image. Pixels more than boxsize below the source
+    # receive no light, so the box starts at the first pixel within it.
+    max_y = min(int(round(ypix+boxsize)), image_size)
+    min_y = max(0, math.ceil(ypix-boxsize))
+    max_x = min(int(round(xpix+boxsize)), image_size)
+    min_x = max(0, math.ceil(xpix-boxsize))
+
+    # Apply real_psf to every pixel in the box
+    ff = _psf_box(xpix, ypix, epsf, psf_center, boxsize, min_x, max_x, min_y, max_y)
+    # Allow for images with additional trailing axes
+    ff = ff.reshape(ff.shape + (1,)*(image.ndim-2))
+    image[min_y:max_y, min_x:max_x] += (flux*ff)
 
     return image
 
 
+def _epsf_weights(xpix, ypix, image_size):
+    """
+    Quadrant and fractional position used to interpolate the 3 x 3 grid
+    of ePSFs at the location of a source, or of a set of sources.
+
+    Parameters
+    ----------
+    xpix : float or numpy.ndarray
+        x location of source(s)
+    ypix : float or numpy.ndarray
+        y location of source(s)
+    image_size : int
+        Image size in pixels
+
+    Returns
+    -------
+    qx, qy : numpy.ndarray
+        Quadrant of the source(s), 0 for the lower/left and 1 for the
+        upper/right half of the image. Sources are interpolated between
+        the ePSFs [qx:qx+2, qy:qy+2] of the grid.
+    xf, yf : numpy.ndarray
+        Fractional position of the source(s) within their quadrant
+    """
+
+    xpix = np.asarray(xpix, dtype=float)
+    ypix = np.asarray(ypix, dtype=float)
+
+    # Pixel location of half image
+    half_image = round(image_size/2)
+
+    # Quadrant of the star, which sets the 2 x 2 ePSFs to interpolate
+    # between: 0 for the lower/left and 1 for the upper/right half.
+    qx = (xpix > half_image).astype(int)
+    qy = (ypix > half_image).astype(int)
+
+    # Fractional position of the star within its quadrant
+    xf = ((xpix+4-qx*(half_image+4))/(half_image+4))
+    yf = ((ypix+4-qy*(half_image+4))/(half_image+4))
+
+    return qx, qy, xf, yf
+
+
 def interpolate_epsf(xpix, ypix, psf_array, image_size):
     """
     Interpolate the input ePSFs at the location of a specified
-    source.
+    source, or of a set of sources.
 
     Parameters
     ----------
-    xpix : float
-        x location of source
-    ypix : float
-        y location of source
-    psf_array : list
-        3 x 3 list with input ePSFs
+    xpix : float or numpy.ndarray
+        x location of source(s)
+    ypix : float or numpy.ndarray
+        y location of source(s)
+    psf_array : numpy.ndarray or list
+        3 x 3 array (or nested list) with input ePSFs. Passing an
+        array avoids stacking the ePSFs on every call.
     image_size : int
         Image size in pixels
 
     Returns
     -------
     epsf : np.array
-        Interpolated ePSF at the location xpix, ypix
+        Interpolated ePSF at the location xpix, ypix. If xpix and
+        ypix are arrays of N locations, this is a stack of N ePSFs
+        with shape (N, ...) where ... is the shape of a single ePSF.
     """
 
-    # Pixel location of half image
-    half_image = round(image_size/2)
+    psf_array = np.asarray(psf_array)
+
+    qx, qy, xf, yf = _epsf_weights(xpix, ypix, image_size)
+
+    # Keep the weights in the precision of the ePSFs, so that float32
+    # ePSFs are not promoted to float64
+    dtype = np.result_type(psf_array.dtype, np.float32)
+    xf = xf.astype(dtype)
+    yf = yf.astype(dtype)
 
-    # If star is in Lower Left Quadrant
-    if (xpix <= half_image and ypix <= half_image):
-        xf = ((xpix+4)/(half_image+4))
-        yf = ((ypix+4)/(half_image+4))
-        epsf = (xf*yf*psf_array[1][1] +
-                (1-xf)*(1-yf)*psf_array[0][0] +
-                (xf)*(1-yf)*psf_array[1][0] +
-                (1-xf)*(yf)*psf_array[0][1])
-
-    # If star is in Lower Right Quadrant
-    elif (xpix > half_image and ypix <= half_image):
-        xf = ((xpix+4-(half_image+4))/(half_image+4))
-        yf = ((ypix+4)/(half_image+4))
-        epsf = (xf*yf*psf_array[2][1] +
-                (1-xf)*(1-yf)*psf_array[1][0] +
-                (xf)*(1-yf)*psf_array[2][0] +
-                (1-xf)*(yf)*psf_array[1][1])
-
-    # If star is in Upper Left Quadrant
-    elif (xpix <= 1.0*half_image and ypix > half_image):
-        xf = ((xpix+4)/(half_image+4))
-        yf = ((ypix+4-(half_image+4))/(half_image+4))
-        epsf = (xf*yf*psf_array[1][2] +
-                (1-xf)*(1-yf)*psf_array[0][1] +
-                (xf)*(1-yf)*psf_array[1][1] +
-                (1-xf)*(yf)*psf_array[0][2])
-
-    # If star is in Upper Right Quadrant
-    elif (xpix > half_image and ypix > half_image):
-        xf = ((xpix+4-(half_image+4))/(half_image+4))
-        yf = ((ypix+4-(half_image+4))/(half_image+4))
-        epsf = (xf*yf*psf_array[2][2] +
-                (1-xf)*(1-yf)*psf_array[1][1] +
-                (xf)*(1-yf)*psf_array[2][1] +
-                (1-xf)*(yf)*psf_array[1][2])
+    # For multiple sources, broadcast the weights over each ePSF
+    if xf.ndim > 0:
+        extra_dims = (1,)*(psf_array.ndim-2)
+        xf = xf.reshape(xf.shape + extra_dims)
+        yf = yf.reshape(yf.shape + extra_dims)
+
+    epsf = (xf*yf*psf_array[qx+1, qy+1] +
+            (1-xf)*(1-yf)*psf_array[qx, qy] +
+            (xf)*(1-yf)*psf_array[qx+1, qy] +
+            (1-xf)*(yf)*psf_array[qx, qy+1])
 
     return epsf
+
+
+def _effective_boxsize(flux, psf_array, boxsize, psf_center, flux_threshold):
+    """
+    Smallest box around each source outside of which the source adds
+    less than flux_threshold to any pixel, capped at boxsize.
+
+    Parameters
+    ----------
+    flux : numpy.ndarray
+        Fluxes of the sources
+    psf_array : numpy.ndarray
+        3 x 3 array with input ePSFs
+    boxsize : int
+        size of PSF box.
+    psf_center : int
+        center of the input psf model
+    flux_threshold : float
+        Smallest contribution of a source to a pixel that is kept
+
+    Returns
+    -------
+    boxes : numpy.ndarray
+        Box size of each source. 0 for sources fainter than
+        flux_threshold on every pixel.
+    """
+
+    # Largest ePSF value (of any ePSF of the grid) on each square ring
+    # around the center, then beyond each ring.
+    epsf_max = np.abs(psf_array).reshape((-1,) + psf_array.shape[-2:]).max(axis=0)
+    iy, ix = np.indices(epsf_max.shape)
+    ring = np.maximum(np.abs(iy-psf_center), np.abs(ix-psf_center))
+    ring_max = np.zeros(ring.max()+1, dtype=float)
+    np.maximum.at(ring_max, ring.ravel(), epsf_max.ravel())
+    outer_max = np.maximum.accumulate(ring_max[::-1])[::-1]
+
+    # Image pixels left out of a box of size r are at least r-1 pixels
+    # from the source, so real_psf samples them from ePSF rings beyond
+    # PSF_UPSCALE*(r-1)-1 (one less for the bilinear neighbour).
+    radii = np.arange(int(math.ceil(boxsize))+1)
+    beyond = outer_max[np.clip(PSF_UPSCALE*(radii-1)-1, 0, len(outer_max)-1)]
+
+    # beyond decreases with r, so the box of each source is the number
+    # of radii at which it is still above the threshold.
+    nbright = len(radii) - np.searchsorted(beyond[::-1], flux_threshold/np.abs(flux), side='left')
+
+    return np.minimum(boxsize, nbright)
+
+
+def place_sources(xpix, ypix, flux, image, psf_array, boxsize=PSF_BOXSIZE, psf_center=177, n_threads=1,
+                  flux_threshold=0.):
+    """
+    Place a set of sources into image, each with the ePSF interpolated
+    at its own location. This gives the same image as calling
+    interpolate_epsf and place_source for every source.
+
+    Parameters
+    ----------
+    xpix : numpy.ndarray
+        x locations of the sources
+    ypix : numpy.ndarray
+        y locations of the sources
+    flux : numpy.ndarray
+        Fluxes of the sources
+    image : numpy.ndarray
+        Empty (or not) 2D array of image where to place sources
+    psf_array : numpy.ndarray
+        3 x 3 array with input ePSFs
+    boxsize : int
+        size of PSF box.
+    psf_center : int
+        center of the input psf model
+    n_threads : int
+        Number of threads to place the sources with, only used if numba
+        is installed. Values below 1 use all the available cores.
+    flux_threshold : float
+        Shrink the box of each source so that it leaves out only pixels
+        where the source adds less than flux_threshold, and skip sources
+        below it everywhere. 0 always uses the full box.
+
+    Returns
+    -------
+    image : numpy.ndarray
+        2D array of image where sources were placed
+    """
+
+    psf_array = np.asarray(psf_array)
+    xpix = np.atleast_1d(np.asarray(xpix, dtype=float))
+    ypix = np.atleast_1d(np.asarray(ypix, dtype=float))
+    flux = np.broadcast_to(np.asarray(flux, dtype=float), xpix.shape)
+
+    # Get image size, assuming square
+    image_size = image.shape[0]
+
+    # Only place sources within the image, in a box of at most boxsize
+    keep = (xpix > 0) & (xpix < image_size) & (ypix > 0) & (ypix < image_size)
+    boxes = np.full(xpix.shape, boxsize)
+    if flux_threshold > 0:
+        boxes = _effective_boxsize(flux, psf_array, boxsize, psf_center, flux_threshold)
+        keep &= boxes > 0
+    xpix, ypix, flux, boxes = xpix[keep], ypix[keep], flux[keep], boxes[keep]
+
+    if not HAS_NUMBA:
+        for x, y, f, b in zip(xpix, ypix, flux, boxes):
+            epsf = interpolate_epsf(x, y, psf_array, image_size)
+            image = place_source(x, y, f, image, epsf, boxsize=b, psf_center=psf_center)
+        return image
+
+    # Corner ePSFs and weights of each source, as in interpolate_epsf.
+    # psf_array[i, j] is grid[3*i+j]. numba compiles for the layout it is
+    # given, so pass a C-contiguous grid to get unit-stride rows.
+    grid = np.ascontiguousarray(psf_array.reshape((-1,) + psf_array.shape[-2:]))
+    qx, qy, xf, yf = _epsf_weights(xpix, ypix, image_size)
+    corners = np.stack([PSF_GRID_SIZE*(qx+1)+qy+1,
+                        PSF_GRID_SIZE*qx+qy,
+                        PSF_GRID_SIZE*(qx+1)+qy,
+                        PSF_GRID_SIZE*qx+qy+1], axis=-1)
+    weights = np.stack([xf*yf,
+                        (1-xf)*(1-yf),
+                        xf*(1-yf),
+                        (1-xf)*yf], axis=-1)
+
+    # Same box around each source as in place_source, clipped to the image
+    max_y = np.minimum(np.round(ypix+boxes), image_size).astype(int)
+    min_y = np.maximum(0, np.ceil(ypix-boxes)).astype(int)
+    max_x = np.minimum(np.round(xpix+boxes), image_size).astype(int)
+    min_x = np.maximum(0, np.ceil(xpix-boxes)).astype(int)
+
+    if n_threads is None:
+        n_threads = 1
+    elif n_threads < 1:
+        n_threads = os.cpu_count() or 1
+    n_threads = min(n_threads, len(xpix))
+
+    if n_threads <= 1:
+        return _place_sources_numba(xpix, ypix, flux, image, grid, corners, weights,
+                                    min_x, max_x, min_y, max_y, psf_center, boxsize, 0)
+
+    # Sort the sources by y and give each thread an equal share. Each
+    # thread places its sources in its own band of rows, spanning just
+    # their boxes, and the bands are added to the image at the end.
+    order = np.argsort(ypix, kind='stable')
+
+    def place_band(idx):
+        row0, row1 = min_y[idx].min(), max_y[idx].max()
+        band = np.zeros((row1-row0, image.shape[1]), dtype=image.dtype)
+        _place_sources_numba(xpix[idx], ypix[idx], flux[idx], band, grid, corners[idx], weights[idx],
+                             min_x[idx], max_x[idx], min_y[idx], max_y[idx], psf_center, boxsize, row0)
+        return row0, row1, band
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        for row0, row1, band in executor.map(place_band, np.array_split(order, n_threads)):
+            image[row0:row1] += band
+
+    return image
@@ -135,6 +135,30 @@ def test_make_epsf_calcs():
                                psf_test_out[size_test-2, 3:(size_test-PSF_UPSCALE)+1])
 
 
+def test_make_epsf_float32():
+
+    # A single precision PSF should give a single precision ePSF, matching
+    # the double precision ePSF to float32 accuracy.
+
+    test_psf_32 = makePSF.make_epsf(file_in.astype(np.float32))
+
+    assert test_psf_32.dtype == np.float32
+
+    np.testing.assert_allclose(test_psf_32, test_psf, rtol=0, atol=1e-6*test_psf.max())
+
+
+@pytest.mark.skipif(not makePSF.HAS_NUMBA, reason="numba is not installed")
+def test_ipc_apply():
+
+    # The compiled IPC kernel should match the pure numpy implementation.
+
+    size_test = file_in.shape[0]
+    psf_test_mid = ndimage.convolve(file_in, EPSF4, mode='constant', cval=0.0)
+
+    np.testing.assert_allclose(makePSF._ipc_apply_numba(psf_test_mid, IPC, size_test),
+                               makePSF._ipc_apply_numpy(psf_test_mid, IPC, size_test))
+
+
 def test_bicubic():
 
     # Run the calculations of the bicubic function "manually".
@@ -231,6 +255,34 @@ def test_real_psf():
     np.testing.assert_allclose(test_rpsf_phot, check_rpsf_phot)
 
 
+def test_real_psf_vec():
+
+    # The vectorized real_psf should match the scalar version for every pixel,
+    # covering the bi-cubic core, the bi-linear wings and pixels outside the box.
+
+    dx = np.arange(-25, 25) + 0.3
+    dy = np.arange(-25, 25) - 0.4
+
+    test_rpsf_vec = makePSF.real_psf_vec(dx[np.newaxis, :], dy[:, np.newaxis], test_psf,
+                                         psf_center=88, boxsize=22)
+
+    check_rpsf_vec = np.array([[makePSF.real_psf(x, y, test_psf, psf_center=88, boxsize=22)
+                                for x in dx] for y in dy])
+
+    np.testing.assert_allclose(test_rpsf_vec, check_rpsf_vec)
+
+
+@pytest.mark.skipif(not makePSF.HAS_NUMBA, reason="numba is not installed")
+def test_psf_box():
+
+    # The compiled PSF box should match the numpy implementation.
+
+    args = (250.3, 249.6, test_psf, 88, 22, 228, 272, 228, 272)
+
+    np.testing.assert_allclose(makePSF._psf_box_numba(*args), makePSF._psf_box_numpy(*args),
+                               rtol=1e-6, atol=1e-12)
+
+
 def test_place_source():
 
     # Place a test source in a blank image, to ensure that this doesn't throw any exceptions.
@@ -355,3 +407,84 @@ def test_interpolate():
     np.testing.assert_allclose(interp_epsf_lr, check_interp_lr, atol=0.001)
 
     np.testing.assert_allclose(interp_epsf_ur, check_interp_ur, atol=0.001)
+
+
+def test_interpolate_batch():
+
+    # Interpolating a set of positions at once should give the same ePSFs
+    # as interpolating each position on its own, in every quadrant.
+
+    image_size = file_in.shape[0]
+
+    test_psf_array = np.array([[test_psf, 2*test_psf, 3*test_psf],
+                               [4*test_psf, 5*test_psf, 6*test_psf],
+                               [7*test_psf, 8*test_psf, 9*test_psf]])
+
+    xpix = np.array([68, 68, 108, 108])
+    ypix = np.array([68, 108, 68, 108])
+
+    interp_epsf_batch = makePSF.interpolate_epsf(xpix, ypix, test_psf_array, image_size)
+
+    assert interp_epsf_batch.shape == (4,) + test_psf.shape
+
+    for k in range(len(xpix)):
+        np.testing.assert_allclose(interp_epsf_batch[k],
+                                   makePSF.interpolate_epsf(xpix[k], ypix[k], test_psf_array, image_size))
+
+
+def test_place_sources():
+
+    # Placing a set of sources at once should give the same image as
+    # interpolating the ePSF and placing each source on its own.
+
+    image_size = 512
+
+    test_psf_array = np.array([[test_psf, 2*test_psf, 3*test_psf],
+                               [4*test_psf, 5*test_psf, 6*test_psf],
+                               [7*test_psf, 8*test_psf, 9*test_psf]])
+
+    psf_middle = rind((test_psf.shape[0]-1)/2)
+    boxsize = np.floor(psf_middle)/PSF_UPSCALE
+
+    xpix = np.array([250.3, 10.6, 400.2, 505.9, 600.])
+    ypix = np.array([249.6, 300.1, 20.8, 490.4, 100.])
+    flux = np.array([15., 2., 300., 7., 1.])
+
+    check_image = np.zeros((image_size, image_size), dtype=np.float32)
+    for x, y, f in zip(xpix, ypix, flux):
+        epsf = makePSF.interpolate_epsf(x, y, test_psf_array, image_size)
+        check_image = makePSF.place_source(x, y, f, check_image, epsf,
+                                           boxsize=boxsize, psf_center=psf_middle)
+
+    image = makePSF.place_sources(xpix, ypix, flux, np.zeros_like(check_image), test_psf_array,
+                                  boxsize=boxsize, psf_center=psf_middle)
+
+    np.testing.assert_allclose(image, check_image, rtol=1e-5, atol=1e-5*check_image.max())
+
+    # Splitting the sources over threads should not change the image
+    image = makePSF.place_sources(xpix, ypix, flux, np.zeros_like(check_image), test_psf_array,
+                                  boxsize=boxsize, psf_center=psf_middle, n_threads=3)
+
+    np.testing.assert_allclose(image, check_image, rtol=1e-5, atol=1e-5*check_image.max())
+
+
+def test_place_sources_threshold():
+
+    # With a flux threshold, each source should only leave out pixels
+    # where it adds less than the threshold, and sources fainter than
+    # the threshold everywhere should be skipped.
+
+    psf_middle = rind((test_psf.shape[0]-1)/2)
+    boxsize = np.floor(psf_middle)/PSF_UPSCALE
+
+    test_psf_array = np.array([[test_psf]*3]*3)
+
+    for flux in [0.1, 1., 100., 1e4]:
+        image = makePSF.place_sources([250.3], [249.6], [flux], np.zeros((512, 512)), test_psf_array,
+                                      boxsize=boxsize, psf_center=psf_middle)
+        image_thr = makePSF.place_sources([250.3], [249.6], [flux], np.zeros((512, 512)), test_psf_array,
+                                          boxsize=boxsize, psf_center=psf_middle, flux_threshold=0.5)
+        assert np.max(np.abs(image - image_thr)) < 0.5
+
+    boxes = makePSF._effective_boxsize(np.array([1e-6, 1e6]), test_psf_array, boxsize, psf_middle, 0.5)
+    np.testing.assert_array_equal(boxes, [0, boxsize])
@@ -25,9 +25,11 @@ from .. import __version__ as __stips__version__
 def rind(x):
     """
     Convenience function to take a float, round it to the nearest integer, and convert it
-    to the ``int`` type.
+    to the ``int`` type. Arrays are rounded element-wise to an integer array.
     """
-    return np.round(x).astype(int)
+    if isinstance(x, (int, float, np.number)):
+        return int(round(x))
+    return np.rint(x).astype(int)
 
 def get_pandeia_background(wfi_filter, webapp = False):
     """